@@ -1,31 +1,44 @@
+import collections
+import concurrent.futures
 import datetime
 import logging
 import os
-import tempfile
 
 import boto3
 import botocore.exceptions
 import numpy as np
 import rasterio
+import rasterio.io
+import rasterio.windows
 from botocore import UNSIGNED
 from botocore.client import Config
-from h3.api.basic_int import h3_get_resolution, h3_to_children, h3_to_geo
+from h3.api.basic_int import h3_get_resolution, h3_to_geo
 
 from elevations_populator.cells import (
-    get_ancestors_up_to_minimum_resolution,
-    get_ancestors_up_to_minimum_resolution_as_pyramid,
     get_descendents_down_to_maximum_resolution,
+    get_minimum_resolution_ancestors,
+    get_parents,
 )
 from elevations_populator.exceptions import DataUnavailable
 from elevations_populator.storage import store_elevations_in_database, store_elevations_locally
-from elevations_populator.tiles import get_tile_path, get_tile_reference_coordinate
+from elevations_populator.tiles import (
+    get_tile_key,
+    get_tile_keys,
+    get_tile_path,
+    get_tile_reference_coordinate_from_key,
+)
 
 
 logger = logging.getLogger(__name__)
-s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED))
 
 
 DATASET_BUCKET_NAME = "copernicus-dem-30m"
+MAXIMUM_CONCURRENT_TILE_DOWNLOADS = 16
+
+s3 = boto3.client(
+    "s3",
+    config=Config(signature_version=UNSIGNED, max_pool_connections=2 * MAXIMUM_CONCURRENT_TILE_DOWNLOADS),
+)
 
 
 class App:
@@ -41,13 +54,10 @@ class App:
         self.MAXIMUM_RESOLUTION = self.analysis.configuration_values.get("maximum_resolution", 12)
         self.STORAGE_LOCATION = self.analysis.configuration_values.get("storage_location", "database")
         self.LOCAL_STORAGE_PATH = self.analysis.configuration_values.get("local_storage_path")
-        self.DELETE_DOWNLOADED_TILES_AFTER_RUN = self.analysis.configuration_values.get(
-            "delete_downloaded_tiles_after_run",
-            True,
-        )
+        self.LOCAL_STORAGE_FORMAT = self.analysis.configuration_values.get("local_storage_format", "json")
+        self.TILE_CACHE_DIRECTORY = self.analysis.configuration_values.get("tile_cache_directory")
 
         self._tiles = {}
-        self._downloaded_tile_paths = []
 
     def run(self):
         """Carry out the following:
@@ -70,54 +80,61 @@ class App:
 
         :return None:
         """
-        logger.info("Received request for the H3 cells %r", self.analysis.input_values["h3_cells"])
+        cells = self.analysis.input_values["h3_cells"]
+        logger.info("Received request for the H3 cells %r", cells)
 
-        try:
-            self._validate_cells(self.analysis.input_values["h3_cells"])
+        # Return early for an empty request so none of the expansion, download, or storage machinery is touched.
+        if not cells:
+            logger.info("No cells were given - nothing to do.")
+            return
 
-            logger.info("Getting minimum resolution (%d) ancestors of input cells.", self.MINIMUM_RESOLUTION)
-            minimum_resolution_ancestors = {
-                get_ancestors_up_to_minimum_resolution(cell, self.MINIMUM_RESOLUTION)[-1]
-                for cell in self.analysis.input_values["h3_cells"]
-            }
+        self._validate_cells(cells)
 
-            # Get the centrepoint coordinates of the maximum resolution descendents of the minimum resolution ancestors.
-            maximum_resolution_cells_and_coordinates = self._get_maximum_resolution_descendent_centrepoint_coordinates(
-                cells=minimum_resolution_ancestors
-            )
+        logger.info("Getting minimum resolution (%d) ancestors of input cells.", self.MINIMUM_RESOLUTION)
+        minimum_resolution_ancestors = set(get_minimum_resolution_ancestors(cells, self.MINIMUM_RESOLUTION).tolist())
+
+        # Get the centrepoint coordinates of the maximum resolution descendents of the minimum resolution ancestors.
+        maximum_resolution_cells_and_coordinates = self._get_maximum_resolution_descendent_centrepoint_coordinates(
+            cells=minimum_resolution_ancestors
+        )
 
+        # Group the cells by the tile containing them once so the tile reference coordinate of each cell is only
+        # calculated once, each tile is downloaded once, and each tile's cells are sampled together.
+        cells_grouped_by_tile = self._group_cells_by_tile(maximum_resolution_cells_and_coordinates)
+
+        # Use a single GDAL environment for the whole download-and-sample phase so it isn't set up and torn down
+        # around every rasterio operation and the block cache stays populated across tiles.
+        with rasterio.Env(GDAL_CACHEMAX=512, VSI_CACHE=True, GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
             # Download only the satellite data elevation tiles needed.
-            self._download_and_load_elevation_tiles(maximum_resolution_cells_and_coordinates.values())
+            self._download_and_load_elevation_tiles(cells_grouped_by_tile.keys())
 
             # Extract the centrepoint elevations of the maximum resolution descendents from the satellite data tiles.
             maximum_resolution_descendent_coordinates_and_elevations = self._get_elevations(
-                cells_and_coordinates=maximum_resolution_cells_and_coordinates
+                cells_grouped_by_tile=cells_grouped_by_tile
             )
 
-            if self.MINIMUM_RESOLUTION == self.MAXIMUM_RESOLUTION:
-                logger.info(
-                    "Skipping ancestor average elevation calculation as the minimum resolution is the same as the "
-                    "maximum resolution."
-                )
-                cells_and_elevations = maximum_resolution_descendent_coordinates_and_elevations
-
-            else:
-                # Calculate the average elevations of all the ancestors up to the minimum resolution ancestors and add
-                # them to the set of maximum resolution cell elevations.
-                cells_and_elevations = self._add_average_elevations_for_ancestors_up_to_minimum_resolution(
-                    cells_and_elevations=maximum_resolution_descendent_coordinates_and_elevations
-                )
+        if self.MINIMUM_RESOLUTION == self.MAXIMUM_RESOLUTION:
+            logger.info(
+                "Skipping ancestor average elevation calculation as the minimum resolution is the same as the "
+                "maximum resolution."
+            )
+            cells_and_elevations = maximum_resolution_descendent_coordinates_and_elevations
 
-            # Store the elevations of all the cells between and including the maximum resolution descendents and the
-            # minimum resolution ancestors.
-            self._store_elevations(cells_and_elevations)
+        else:
+            # Calculate the average elevations of all the ancestors up to the minimum resolution ancestors and add
+            # them to the set of maximum resolution cell elevations.
+            cells_and_elevations = self._add_average_elevations_for_ancestors_up_to_minimum_resolution(
+                cells_and_elevations=maximum_resolution_descendent_coordinates_and_elevations
+            )
 
-        finally:
-            if self.DELETE_DOWNLOADED_TILES_AFTER_RUN:
-                logger.info("Deleting satellite elevation data tiles.")
+        # Store the elevations of all the cells between and including the maximum resolution descendents and the
+        # minimum resolution ancestors.
+        storage_future = self._store_elevations(cells_and_elevations)
 
-                for tile in self._downloaded_tile_paths:
-                    os.remove(tile)
+        # Wait for any background local storage write to finish before declaring the analysis done - unretrieved
+        # futures swallow their exceptions, so failing to write the results would otherwise report success.
+        if storage_future is not None:
+            storage_future.result()
 
     def _validate_cells(self, cells):
         """Check that the given cells are within the minimum and maximum resolutions inclusively.
@@ -147,58 +164,125 @@ class App:
             self.MINIMUM_RESOLUTION,
         )
 
-        # Get and de-duplicate the descendents.
-        descendents = {
-            descendent
-            for cell in cells
-            for descendent in get_descendents_down_to_maximum_resolution(cell, self.MAXIMUM_RESOLUTION)
-        }
+        # The given cells are already deduplicated minimum resolution ancestors and distinct ancestors have disjoint
+        # descendent sets, so concatenating the per-ancestor descendent arrays can't repeat a cell.
+        descendents = np.concatenate(
+            [get_descendents_down_to_maximum_resolution(cell, self.MAXIMUM_RESOLUTION) for cell in cells]
+        )
 
         logger.info("Converting centre-points of maximum resolution descendents to latitude/longitude pairs.")
-        return {descendent: h3_to_geo(descendent) for descendent in descendents}
 
-    def _download_and_load_elevation_tiles(self, coordinates):
-        """Download and load the elevation tiles needed to get the elevations of the given coordinates.
+        # The conversion has to be per cell - the h3 v3 APIs (including h3.api.numpy_int) only accept scalar cell
+        # inputs, so there's no batched equivalent of h3_to_geo to call here.
+        return {descendent: h3_to_geo(descendent) for descendent in descendents.tolist()}
 
-        :param iter(tuple(float, float)) coordinates: the (latitude, longitude) pairs to get the satellite tiles for
-        :return None:
+    def _group_cells_by_tile(self, cells_and_coordinates):
+        """Group the given cells by the tile containing their centrepoints.
+
+        :param dict(int, tuple(float, float)) cells_and_coordinates: a mapping of cell index to latitude/longitude pair
+        :return dict(int, list(tuple(int, float, float))): a mapping of tile key to the (cell, latitude, longitude) triples of the cells within the tile
         """
-        logger.info("Determining which satellite elevation data tiles to download.")
+        cells_grouped_by_tile = collections.defaultdict(list)
+
+        # Calculate all the tile keys in one vectorised operation instead of applying the truncation rule per cell.
+        number_of_cells = len(cells_and_coordinates)
+        latitudes = np.fromiter(
+            (latitude for latitude, _ in cells_and_coordinates.values()),
+            dtype=np.float64,
+            count=number_of_cells,
+        )
+
+        longitudes = np.fromiter(
+            (longitude for _, longitude in cells_and_coordinates.values()),
+            dtype=np.float64,
+            count=number_of_cells,
+        )
+        tile_keys = get_tile_keys(latitudes, longitudes)
+
+        for tile_key, (cell, (latitude, longitude)) in zip(tile_keys.tolist(), cells_and_coordinates.items()):
+            cells_grouped_by_tile[tile_key].append((cell, latitude, longitude))
 
-        # Deduplicate the coordinates of the tiles containing the coordinates so each tile is only downloaded once.
-        tile_reference_coordinates = {get_tile_reference_coordinate(lat, lng) for lat, lng in coordinates}
+        return cells_grouped_by_tile
 
+    def _download_and_load_elevation_tiles(self, tile_keys):
+        """Download and load the elevation tiles with the given keys.
+
+        :param iter(int) tile_keys: the keys of the satellite tiles to download
+        :return None:
+        """
         logger.info("Downloading and loading required satellite tiles:")
+        tile_keys = list(tile_keys)
 
-        for tile_latitude, tile_longitude in tile_reference_coordinates:
-            tile_coordinate = (tile_latitude, tile_longitude)
+        # Download the tiles concurrently - each download is dominated by the network round trip to the dataset
+        # bucket, during which the client releases the GIL.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAXIMUM_CONCURRENT_TILE_DOWNLOADS) as executor:
+            tiles = executor.map(self._download_and_load_elevation_tile_if_available, tile_keys)
 
-            try:
-                logger.info(" --> Downloading tile with reference lat/lng (%d, %d)...", *tile_coordinate)
-                self._tiles[tile_coordinate] = self._download_and_load_elevation_tile(*tile_coordinate)
+            for tile_key, tile in zip(tile_keys, tiles):
+                self._tiles[tile_key] = tile
 
-            except DataUnavailable:
-                logger.warning(
-                    " --! Data is unavailable for this tile. Elevations for cells within it will be set to 0m.",
-                )
+    def _download_and_load_elevation_tile_if_available(self, tile_key):
+        """Download and load the elevation tile with the given key, returning `None` if no data is available for it.
 
-                self._tiles[tile_coordinate] = None
+        :param int tile_key: the key of the tile to download
+        :return rasterio.io.DatasetReader|None: the elevation tile as a RasterIO dataset if data is available for it
+        """
+        tile_coordinate = get_tile_reference_coordinate_from_key(tile_key)
 
-    def _get_elevations(self, cells_and_coordinates):
-        """Get the elevation of each cell in meters using the coordinates it's mapped to.
+        try:
+            logger.info(" --> Downloading tile with reference lat/lng (%d, %d)...", *tile_coordinate)
+            return self._download_and_load_elevation_tile(*tile_coordinate)
 
-        :param dict(int, tuple(float, float)) cells_and_coordinates: a mapping of cell index to latitude/longitude pair
+        except DataUnavailable:
+            logger.warning(" --! Data is unavailable for this tile. Elevations for cells within it will be set to 0m.")
+            return None
+
+    def _get_elevations(self, cells_grouped_by_tile):
+        """Get the elevation of each cell in meters, sampling each tile's cells together.
+
+        :param dict(int, list(tuple(int, float, float))) cells_grouped_by_tile: a mapping of tile key to the (cell, latitude, longitude) triples of the cells within the tile
         :return dict(int, float): a mapping of cell index to elevation in meters
         """
         logger.info("Extracting elevations for resolution %d cells from satellite tiles.", self.MAXIMUM_RESOLUTION)
-        number_of_cells = len(cells_and_coordinates)
+        number_of_cells = sum(len(cells) for cells in cells_grouped_by_tile.values())
         elevations = {}
+        number_of_elevations_extracted = 0
 
-        for i, (cell, (latitude, longitude)) in enumerate(cells_and_coordinates.items()):
-            elevations[cell] = self._get_elevation(latitude, longitude)
+        for tile_key, cells in cells_grouped_by_tile.items():
+            # Drop the tile from the cache once its cells have been sampled so its buffer can be reclaimed while the
+            # remaining tiles are processed.
+            tile = self._tiles.pop(tile_key)
 
-            if i % round(0.02 * number_of_cells) == 0:
-                logger.info("%d of %d elevations extracted.", i + 1, number_of_cells)
+            if tile is None:
+                for cell, _, _ in cells:
+                    elevations[cell] = 0
+
+            else:
+                # Locate every cell centrepoint's pixel with the tile's inverse affine transform, read the pixels'
+                # bounding window in one call, and gather the elevations with fancy indexing instead of entering the
+                # raster reader once per cell.
+                latitudes = np.fromiter((latitude for _, latitude, _ in cells), dtype=np.float64, count=len(cells))
+                longitudes = np.fromiter((longitude for _, _, longitude in cells), dtype=np.float64, count=len(cells))
+
+                columns, rows = ~tile.transform * (longitudes, latitudes)
+                columns = np.floor(columns).astype(np.int64)
+                rows = np.floor(rows).astype(np.int64)
+
+                first_row, first_column = rows.min(), columns.min()
+
+                window = rasterio.windows.Window(
+                    col_off=first_column,
+                    row_off=first_row,
+                    width=columns.max() - first_column + 1,
+                    height=rows.max() - first_row + 1,
+                )
+
+                block = tile.read(1, window=window, out_dtype="float32", masked=False)
+                cell_elevations = block[rows - first_row, columns - first_column]
+                elevations.update(zip((cell for cell, _, _ in cells), cell_elevations.tolist()))
+
+            number_of_elevations_extracted += len(cells)
+            logger.info("%d of %d elevations extracted.", number_of_elevations_extracted, number_of_cells)
 
         return elevations
 
@@ -211,32 +295,47 @@ class App:
         """
         logger.info("Calculating average elevations for ancestor cells up to resolution %d:", self.MINIMUM_RESOLUTION)
 
-        ancestors_pyramid = get_ancestors_up_to_minimum_resolution_as_pyramid(
-            cells_and_elevations.keys(),
-            minimum_resolution=self.MINIMUM_RESOLUTION,
-        )
+        cells = np.fromiter(cells_and_elevations.keys(), dtype=np.uint64)
+        elevations = np.array(list(cells_and_elevations.values()), dtype=np.float64)
+
+        # Traverse the resolutions from the highest to the lowest so the elevations of each ancestor's direct children
+        # are always known before calculating the ancestor's own elevation. Each level's means are calculated in one
+        # vectorised reduction by sorting the cells' elevations by parent and summing each parent's run of children.
+        for resolution in range(self.MAXIMUM_RESOLUTION, self.MINIMUM_RESOLUTION, -1):
+            logger.info(" --> Resolution %d...", resolution - 1)
 
-        for i, ancestor_level in enumerate(ancestors_pyramid):
-            logger.info(" --> Resolution %d...", self.MAXIMUM_RESOLUTION - (i + 1))
+            parents = get_parents(cells)
+            order = np.argsort(parents, kind="stable")
+            sorted_elevations = elevations[order]
 
-            # Traverse the ancestor levels from the highest resolution to the lowest so the elevations of each
-            # ancestor's direct children are always known before calculating the ancestor's own elevation.
-            for ancestor in ancestor_level:
-                children_elevations = [cells_and_elevations[child] for child in h3_to_children(ancestor)]
-                cells_and_elevations[ancestor] = np.mean(children_elevations)
+            unique_parents, first_child_indexes, child_counts = np.unique(
+                parents[order],
+                return_index=True,
+                return_counts=True,
+            )
+
+            parent_elevations = np.add.reduceat(sorted_elevations, first_child_indexes) / child_counts
+
+            # Convert both arrays to Python scalars in bulk rather than boxing each value individually.
+            cells_and_elevations.update(zip(unique_parents.tolist(), parent_elevations.tolist()))
+            cells, elevations = unique_parents, parent_elevations
 
         return cells_and_elevations
 
     def _store_elevations(self, cells_and_elevations):
-        """Store the given elevations in the database or locally depending on the app configuration.
+        """Store the given elevations in the database or locally depending on the app configuration. Local storage
+        happens on a background thread - wait on the returned future to block until the write has finished.
 
         :param dict(int, float) cells_and_elevations: the cell indexes mapped to their elevations
-        :return None:
+        :return concurrent.futures.Future|None: a future that completes when the elevations have been written if storing locally
         """
         if self.STORAGE_LOCATION == "local":
-            store_elevations_locally(
+            default_path = f"elevations-{datetime.datetime.now().isoformat()}.{self.LOCAL_STORAGE_FORMAT}"
+
+            return store_elevations_locally(
                 cells_and_elevations,
-                path=self.LOCAL_STORAGE_PATH or f"elevations-{datetime.datetime.now().isoformat()}.json",
+                path=self.LOCAL_STORAGE_PATH or default_path,
+                file_format=self.LOCAL_STORAGE_FORMAT,
             )
         else:
             store_elevations_in_database(cells_and_elevations)
@@ -249,31 +348,54 @@ class App:
         :param float longitude: the longitude in decimal degrees
         :return float: the elevation of the coordinate in meters
         """
-        tile = self._tiles[get_tile_reference_coordinate(latitude, longitude)]
+        tile = self._tiles[get_tile_key(latitude, longitude)]
 
         if tile is None:
             return 0
 
-        elevation_map = tile.read(1)
-        return elevation_map[tile.index(longitude, latitude)]
+        # Read just the single pixel containing the coordinate - the tiles are cloud-optimised GeoTIFFs, so this only
+        # pulls the internal block containing the pixel rather than the whole elevation band.
+        row, column = tile.index(longitude, latitude)
+
+        # Read the band unmasked and at its native dtype so no mask or conversion arrays are allocated.
+        window = rasterio.windows.Window(column, row, 1, 1)
+        return tile.read(1, window=window, out_dtype="float32", masked=False)[0, 0]
 
     def _download_and_load_elevation_tile(self, latitude, longitude):
-        """Download and load the elevation tile containing the given coordinate.
+        """Download the elevation tile containing the given coordinate into an in-memory buffer and load it from
+        there, avoiding a round trip through a temporary file on disk. If a tile cache directory is configured,
+        previously downloaded tiles are loaded from it instead of being re-downloaded, and newly downloaded tiles are
+        added to it.
 
         :param int latitude: the latitude of the bottom-left corner of the tile in decimal degrees
         :param int longitude: the longitude of the bottom-left corner of the tile in decimal degrees
         :return rasterio.io.DatasetReader: the elevation tile as a RasterIO dataset
         """
-        with tempfile.NamedTemporaryFile(delete=False) as temporary_file:
-            with open(temporary_file.name, "wb") as f:
-                try:
-                    s3.download_fileobj(DATASET_BUCKET_NAME, get_tile_path(latitude, longitude), f)
-                except botocore.exceptions.ClientError:
-                    raise DataUnavailable(
-                        f"Could not download satellite tile for tile reference latitude/longitude ({latitude}, "
-                        f"{longitude}) - there may be no data for the coordinates contained in this tile (for example, "
-                        f"if it is in the sea).",
-                    )
-
-        self._downloaded_tile_paths.append(temporary_file.name)
-        return rasterio.open(temporary_file.name)
+        tile_path = get_tile_path(latitude, longitude)
+
+        if self.TILE_CACHE_DIRECTORY:
+            cache_path = os.path.join(self.TILE_CACHE_DIRECTORY, os.path.basename(tile_path))
+
+            if os.path.exists(cache_path):
+                logger.info("Loading tile %r from the tile cache.", os.path.basename(tile_path))
+                return rasterio.open(cache_path)
+
+        memory_file = rasterio.io.MemoryFile()
+
+        try:
+            s3.download_fileobj(DATASET_BUCKET_NAME, tile_path, memory_file)
+        except botocore.exceptions.ClientError:
+            raise DataUnavailable(
+                f"Could not download satellite tile for tile reference latitude/longitude ({latitude}, "
+                f"{longitude}) - there may be no data for the coordinates contained in this tile (for example, "
+                f"if it is in the sea).",
+            )
+
+        if self.TILE_CACHE_DIRECTORY:
+            os.makedirs(self.TILE_CACHE_DIRECTORY, exist_ok=True)
+            memory_file.seek(0)
+
+            with open(cache_path, "wb") as cache_file:
+                cache_file.write(memory_file.read())
+
+        return memory_file.open()
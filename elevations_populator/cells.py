@@ -1,21 +1,94 @@
-from h3.api.basic_int import h3_get_resolution, h3_to_children, h3_to_parent
+import numpy as np
+from h3.api.basic_int import h3_get_resolution
+
+# The numpy_int API returns cell collections as uint64 arrays directly, avoiding a set of boxed Python ints where the
+# result feeds straight into NumPy.
+from h3.api.numpy_int import get_pentagon_indexes
+
+
+def get_parents(cells):
+    """Get the parent of each of the given cells in a single vectorised operation. A cell's parent is derived directly
+    from the bit layout of its 64-bit H3 index - the resolution nibble is decremented and the cell's own resolution
+    digit is set to the unused-digit marker - so no per-cell call into the H3 library is needed. All the given cells
+    must be of resolution 1 or above.
+
+    :param iter(int) cells: the indexes of the cells to get the parents of
+    :return numpy.ndarray: the indexes of the parents of the cells as unsigned 64-bit integers
+    """
+    cells = np.fromiter(cells, dtype=np.uint64)
+    resolutions = (cells >> np.uint64(52)) & np.uint64(0xF)
+
+    parents = cells & ~(np.uint64(0xF) << np.uint64(52))
+    parents |= (resolutions - np.uint64(1)) << np.uint64(52)
+    parents |= np.uint64(0b111) << (np.uint64(3) * (np.uint64(15) - resolutions))
+    return parents
+
+
+def get_children(cells):
+    """Get all the children of the given cells in a single vectorised operation. A cell's children are derived
+    directly from the bit layout of its 64-bit H3 index - the resolution nibble is incremented and the child
+    resolution's digit is set to each of its possible values - so no per-cell call into the H3 library is needed. The
+    nonexistent child of any pentagon cell is excluded. All the given cells must be of the same resolution.
+
+    :param iter(int) cells: the indexes of the cells to get the children of
+    :return numpy.ndarray: the indexes of the children of the cells as unsigned 64-bit integers
+    """
+    cells = np.fromiter(cells, dtype=np.uint64)
+    resolution = int(cells[0] >> np.uint64(52) & np.uint64(0xF))
+    child_digit_shift = np.uint64(3 * (15 - (resolution + 1)))
+
+    # Each cell's children share its index but with the resolution nibble incremented and the child resolution's
+    # digit (currently the unused-digit marker) taking each of the seven possible values.
+    base_children = cells & ~(np.uint64(0xF) << np.uint64(52))
+    base_children |= np.uint64(resolution + 1) << np.uint64(52)
+    base_children &= ~(np.uint64(0b111) << child_digit_shift)
+    children = base_children[:, np.newaxis] | (np.arange(7, dtype=np.uint64) << child_digit_shift)
+
+    # Pentagons only have six children - the child on the skipped axis (digit 1) doesn't exist.
+    pentagons = np.isin(cells, get_pentagon_indexes(resolution))
+
+    if pentagons.any():
+        valid_children = np.ones(children.shape, dtype=bool)
+        valid_children[pentagons, 1] = False
+        return children[valid_children]
+
+    return children.ravel()
+
+
+def get_minimum_resolution_ancestors(cells, minimum_resolution):
+    """Get the minimum resolution ancestor of each of the given cells in a single vectorised operation. The ancestor
+    at an arbitrary coarser resolution is derived directly from the bit layout of a cell's 64-bit H3 index - the
+    resolution nibble is set to the minimum resolution and the digits of every finer resolution are set to the
+    unused-digit marker - so no per-cell walk up the resolutions is needed. Cells already at the minimum resolution
+    are returned unchanged. All the given cells must be of the minimum resolution or finer.
+
+    :param iter(int) cells: the indexes of the cells to get the minimum resolution ancestors of
+    :param int minimum_resolution: the resolution of the ancestors to get
+    :return numpy.ndarray: the indexes of the minimum resolution ancestors of the cells as unsigned 64-bit integers
+    """
+    cells = np.fromiter(cells, dtype=np.uint64)
+
+    # The digits of all resolutions finer than the minimum resolution occupy the lowest bits of the index.
+    ancestors = cells | np.uint64((1 << (3 * (15 - minimum_resolution))) - 1)
+    ancestors &= ~(np.uint64(0xF) << np.uint64(52))
+    ancestors |= np.uint64(minimum_resolution) << np.uint64(52)
+    return ancestors
 
 
 def get_descendents_down_to_maximum_resolution(cell, maximum_resolution):
     """Get all descendents of the cell down to the maximum resolution inclusively. If the resolution of the cell is
-    the same as the maximum resolution, the cell is simply returned as a single-element set.
+    the same as the maximum resolution, the cell is simply returned as a single-element array.
 
     :param int cell: the index of the cell to get the descendents of
     :param int maximum_resolution: the highest resolution (smallest cell size) to get the descendents down to inclusively
-    :return set: the indexes of the descendents of the cell
+    :return numpy.ndarray: the indexes of the descendents of the cell as unsigned 64-bit integers
     """
-    descendents = set()
-
-    if h3_get_resolution(cell) == maximum_resolution:
-        return {cell}
+    descendents = np.fromiter([cell], dtype=np.uint64)
 
-    for child in h3_to_children(cell):
-        descendents |= get_descendents_down_to_maximum_resolution(child, maximum_resolution)
+    # Expand level by level so each level's children are derived in one vectorised operation. The descendents of a
+    # single cell are distinct by construction, so the array needs no deduplication.
+    for _ in range(maximum_resolution - h3_get_resolution(cell)):
+        descendents = get_children(descendents)
 
     return descendents
 
@@ -28,14 +101,19 @@ def get_ancestors_up_to_minimum_resolution(cell, minimum_resolution):
     :param int minimum_resolution: the lowest resolution (largest cell size) to get the ancestors up to inclusively
     :return list: the ancestors of the cell
     """
-    if h3_get_resolution(cell) == minimum_resolution:
+    resolution = h3_get_resolution(cell)
+
+    if resolution == minimum_resolution:
         return [cell]
 
     ancestors = []
 
-    while h3_get_resolution(cell) > minimum_resolution:
-        # Add the cell's parent to the list of ancestors.
-        cell = h3_to_parent(cell)
+    # Walk up the resolutions with the same bit manipulation as `get_parents` - mark the current resolution's digit
+    # unused and decrement the resolution nibble - instead of calling into the H3 library once per level.
+    while resolution > minimum_resolution:
+        cell |= 0b111 << (3 * (15 - resolution))
+        resolution -= 1
+        cell = (cell & ~(0xF << 52)) | (resolution << 52)
         ancestors.append(cell)
 
     return ancestors
@@ -61,10 +139,16 @@ def get_ancestors_up_to_minimum_resolution_as_pyramid(cells, minimum_resolution)
     :param int minimum_resolution: the lowest resolution (largest cell size) to get the ancestors up to inclusively
     :return list(set(int)): the ancestors as an inverted pyramid
     """
-    pyramid = list(zip(*[get_ancestors_up_to_minimum_resolution(cell, minimum_resolution) for cell in cells]))
-
-    # Deduplicate each level.
-    for i, cells in enumerate(pyramid):
-        pyramid[i] = set(cells)
+    cells = np.fromiter(cells, dtype=np.uint64)
+    resolution = h3_get_resolution(int(cells[0]))
+    pyramid = []
+
+    # Walk up one resolution at a time, deduplicating each level before deriving the next so every parent transition
+    # is only computed once - siblings collapse onto the same parent, shrinking each level roughly sevenfold. The
+    # levels stay as contiguous arrays while walking, deduplicated by np.unique instead of rehashing into a Python
+    # set, and are only converted to sets at the boundary.
+    for _ in range(resolution - minimum_resolution):
+        cells = np.unique(get_parents(cells))
+        pyramid.append(set(cells.tolist()))
 
     return pyramid
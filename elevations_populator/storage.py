@@ -1,10 +1,16 @@
+import atexit
+import concurrent.futures
 import json
 import logging
 import os
+import zipfile
 
-from h3.api.basic_int import h3_get_resolution, h3_to_parent
+import numpy as np
+from h3.api.basic_int import h3_get_resolution
 from neo4j import GraphDatabase
 
+from elevations_populator.cells import get_parents
+
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +19,11 @@ driver = GraphDatabase.driver(
     auth=(os.environ["NEO4J_USERNAME"], os.environ["NEO4J_PASSWORD"]),
 )
 
+# A single-worker pool for local storage writes so serialisation and disk writing overlap with the caller's next batch
+# of work. Any writes still pending at interpreter shutdown are completed before exit.
+_local_write_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+atexit.register(_local_write_pool.shutdown, wait=True)
+
 
 DATABASE_NAME = "neo4j"
 UPLOAD_CHUNK_SIZE = 1000
@@ -22,8 +33,60 @@ COPERNICUS_GLO_30_DATA_SOURCE_URI = "s3://copernicus-dem-30m/"
 COPERNICUS_GLO_30_DATA_SOURCE_ELEVATION_UNIT = "m"
 
 
-def store_elevations_locally(cells_and_elevations, path):
-    """Store the given elevations as a JSON file at the given local path.
+def store_elevations_locally(cells_and_elevations, path, file_format="json"):
+    """Store the given elevations in a file at the given local path. The "json" file format is human-readable; the
+    "npz" format is a compressed NumPy archive of a `cells` array and an `elevations` array holding the elevations as
+    integer decimeters (divide by 10 for meters), which is several times smaller and faster to write for large
+    numbers of cells. The write is carried out on a background thread so the
+    caller isn't blocked on serialisation and disk I/O - wait on the returned future to block until the write has
+    finished.
+
+    :param dict(int, float) cells_and_elevations: the h3 cells and their elevations
+    :param str path: the path to save the file at
+    :param str file_format: the format to save the elevations in - either "json" or "npz"
+    :return concurrent.futures.Future: a future that completes when the elevations have been written
+    """
+    if file_format == "npz":
+        return _local_write_pool.submit(_write_elevations_npz_file, cells_and_elevations, path)
+
+    return _local_write_pool.submit(_write_elevations_file, cells_and_elevations, path)
+
+
+def _write_elevations_npz_file(cells_and_elevations, path):
+    """Write the given elevations to a compressed NumPy archive at the given local path, appending to any elevations
+    already stored there.
+
+    :param dict(int, float) cells_and_elevations: the h3 cells and their elevations
+    :param str path: the path to save the archive at
+    :return None:
+    """
+    # `np.savez_compressed` appends an ".npz" extension to paths that lack one, so normalise the path up front to
+    # ensure the append read below targets the same file as the write.
+    if not path.endswith(".npz"):
+        path += ".npz"
+
+    logger.info("Storing elevations locally at %r.", os.path.abspath(path))
+
+    cells = np.fromiter(cells_and_elevations.keys(), dtype=np.uint64)
+
+    # Quantise to integer decimeters - a uniform 0.1m step is comfortably finer than the vertical accuracy of the
+    # source dataset, and integer runs compress far better than floats. A 32-bit integer is used as decimeter counts
+    # above 3276.7m (e.g. in the Alps) would overflow 16 bits.
+    elevations = np.round(np.fromiter(cells_and_elevations.values(), dtype=np.float64) * 10).astype(np.int32)
+
+    try:
+        with np.load(path) as persisted_data:
+            cells = np.concatenate([persisted_data["cells"], cells])
+            elevations = np.concatenate([persisted_data["elevations"], elevations])
+
+    except (EOFError, FileNotFoundError, zipfile.BadZipFile):
+        pass
+
+    np.savez_compressed(path, cells=cells, elevations=elevations)
+
+
+def _write_elevations_file(cells_and_elevations, path):
+    """Write the given elevations to a JSON file at the given local path.
 
     :param dict(int, float) cells_and_elevations: the h3 cells and their elevations
     :param str path: the path to save the JSON file at
@@ -42,8 +105,11 @@ def store_elevations_locally(cells_and_elevations, path):
         # Convert numpy float type to python float type.
         persisted_data.append([cell, float(elevation)])
 
+    # Write compactly - indentation multiplies the file size several times over for numeric rows and dominates the
+    # write time for large dumps. Serialise to a single string first so the file is written in one call instead of
+    # the many small writes `json.dump` streams out.
     with open(path, "w") as f:
-        json.dump(persisted_data, f, indent=4)
+        f.write(json.dumps(persisted_data, separators=(",", ":")))
 
 
 def store_elevations_in_database(cells_and_elevations, data_source_uri=COPERNICUS_GLO_30_DATA_SOURCE_URI):
@@ -58,66 +124,94 @@ def store_elevations_in_database(cells_and_elevations, data_source_uri=COPERNICU
     cells_and_elevations = tuple(cells_and_elevations.items())
     number_of_chunks = int(len(cells_and_elevations) / UPLOAD_CHUNK_SIZE)
 
-    for i, j in enumerate(range(0, len(cells_and_elevations), UPLOAD_CHUNK_SIZE)):
-        logger.info(" --> Uploading chunk %d of %d", i + 1, number_of_chunks)
-
-        with driver:
-            with driver.session(database=DATABASE_NAME) as session:
-                session.execute_write(
-                    _create_cells_and_elevations,
-                    cells_and_elevations[j : j + UPLOAD_CHUNK_SIZE],
-                    data_source_uri,
-                )
+    with driver:
+        with driver.session(database=DATABASE_NAME) as session:
+            # Get the data source node's internal id once up front so each upload chunk can refer to the node by
+            # identity instead of matching its URI per row.
+            data_source_id = session.execute_write(
+                _get_or_create_data_source,
+                name=COPERNICUS_GLO_30_DATA_SOURCE_NAME,
+                uri=data_source_uri,
+            )
+
+            # Use an explicit transaction so each chunk's queries are streamed to the server as soon as they're built,
+            # letting the client prepare the next chunk while the server processes the previous one, and commit once
+            # at the end.
+            with session.begin_transaction() as transaction:
+                for i, j in enumerate(range(0, len(cells_and_elevations), UPLOAD_CHUNK_SIZE)):
+                    logger.info(" --> Uploading chunk %d of %d", i + 1, number_of_chunks)
+                    _create_cells_and_elevations(
+                        transaction,
+                        cells_and_elevations[j : j + UPLOAD_CHUNK_SIZE],
+                        data_source_id,
+                    )
+
+                transaction.commit()
 
     logger.info("Elevations uploaded.")
 
 
 def create_data_source(name, uri):
-    """Create a data source node in the database.
+    """Create a data source node in the database if it doesn't already exist.
 
     :param str name: the name of the data source
     :param str uri: the URI used to access the data source
     :return None:
     """
     logger.info("Creating data source node in database.")
-    query = "CREATE (:DataSource {name: %r, uri: %r})" % (name, uri)
 
     with driver:
         with driver.session(database=DATABASE_NAME) as session:
-            session.run(query)
+            session.execute_write(_get_or_create_data_source, name=name, uri=uri)
 
     logger.info("Data source node created.")
 
 
-def _create_cells_and_elevations(tx, cells_and_elevations, data_source_uri):
+def _get_or_create_data_source(tx, name, uri):
+    """Get the internal id of the data source node with the given URI, creating the node first if it doesn't already
+    exist.
+
+    :param neo4j._sync.work.transaction.ManagedTransaction tx:
+    :param str name: the name of the data source
+    :param str uri: the URI used to access the data source
+    :return str: the internal id of the data source node
+    """
+    query = """
+    MERGE (data_source:DataSource {uri: $uri})
+    SET data_source.name = $name
+    RETURN elementId(data_source) AS id
+    """
+
+    return tx.run(query, name=name, uri=uri).single()["id"]
+
+
+def _create_cells_and_elevations(tx, cells_and_elevations, data_source_id):
     """Construct and run the queries to create the given cells and elevations in the Neo4j graph database, connect the
     cells to their elevations, connect each cell to its parent, and connect each elevation to its data source.
 
     :param neo4j._sync.work.transaction.ManagedTransaction tx:
-    :param str data_source_uri: the URI of the data source that provided the elevations
     :param tuple(int, float) cells_and_elevations: the h3 cells and their elevations
+    :param str data_source_id: the internal id of the data source node that provided the elevations
     :return None:
     """
-    cells_and_elevations_query_parts = []
-    cell_and_parent_indexes = []
-
-    for cell, elevation in cells_and_elevations:
-        cells_and_elevations_query_parts.append(
-            "(:Cell {index: %d, resolution: %d})-[:HAS_ELEVATION]->(:Elevation {value: %f, unit: %r})-[:HAS_SOURCE]"
-            "->(data_source)" % (cell, h3_get_resolution(cell), elevation, COPERNICUS_GLO_30_DATA_SOURCE_ELEVATION_UNIT)
-        )
+    rows = [
+        {"index": cell, "resolution": h3_get_resolution(cell), "elevation": float(elevation)}
+        for cell, elevation in cells_and_elevations
+    ]
 
-        cell_and_parent_indexes.append((cell, h3_to_parent(cell)))
+    # Compute all the parents in one vectorised operation instead of calling into the H3 library once per cell.
+    parents = get_parents(cell for cell, _ in cells_and_elevations)
+    cell_and_parent_indexes = [(cell, int(parent)) for (cell, _), parent in zip(cells_and_elevations, parents)]
 
     cells_and_elevations_query = """
-    MATCH
-      (data_source:DataSource)
-    WHERE data_source.uri = %r
-    CREATE %s
-    """ % (
-        data_source_uri,
-        ", ".join(cells_and_elevations_query_parts),
-    )
+    MATCH (data_source)
+    WHERE elementId(data_source) = $data_source_id
+    UNWIND $rows AS row
+    CREATE
+      (:Cell {index: row.index, resolution: row.resolution})
+      -[:HAS_ELEVATION]->(:Elevation {value: row.elevation, unit: $unit})
+      -[:HAS_SOURCE]->(data_source)
+    """
 
     cell_parent_relationships_query = """
     UNWIND $indexes AS index_pair
@@ -129,5 +223,11 @@ def _create_cells_and_elevations(tx, cells_and_elevations, data_source_uri):
     CREATE (parent)-[:PARENT_OF]->(child)
     """
 
-    tx.run(cells_and_elevations_query)
+    tx.run(
+        cells_and_elevations_query,
+        data_source_id=data_source_id,
+        rows=rows,
+        unit=COPERNICUS_GLO_30_DATA_SOURCE_ELEVATION_UNIT,
+    )
+
     tx.run(cell_parent_relationships_query, indexes=cell_and_parent_indexes)
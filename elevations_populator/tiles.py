@@ -1,6 +1,9 @@
 # Constants for downloading elevation tile data from the Copernicus GLO-30 dataset.
+import functools
 import math
 
+import numpy as np
+
 
 DATASET_RESOLUTION = 10  # The resolution of the GLO-30 dataset is 10 arcseconds.
 DATAFILE_NAME_PREFIX = "Copernicus_DSM_COG"
@@ -15,34 +18,73 @@ def get_tile_reference_coordinate(latitude, longitude):
     :param float longitude: the longitude of the coordinate (in decimal degrees) for which to get the containing tile
     :return (int, int): the reference coordinate (in decimal degrees) of the tile containing the given coordinate
     """
-    if latitude < 0:
-        latitude -= 1
+    return math.floor(latitude), math.floor(longitude)
+
+
+def get_tile_key(latitude, longitude):
+    """Get the key of the tile containing the given coordinate. A tile's key is its reference coordinate packed into
+    a single integer, which is cheaper to hash and compare than a latitude/longitude tuple when looking tiles up per
+    cell.
+
+    :param float latitude: the latitude of the coordinate (in decimal degrees) for which to get the containing tile
+    :param float longitude: the longitude of the coordinate (in decimal degrees) for which to get the containing tile
+    :return int: the key of the tile containing the given coordinate
+    """
+    tile_latitude, tile_longitude = get_tile_reference_coordinate(latitude, longitude)
+    return ((tile_latitude & 0xFFFF) << 16) | (tile_longitude & 0xFFFF)
+
 
-    if longitude < 0:
-        longitude -= 1
+def get_tile_keys(latitudes, longitudes):
+    """Get the keys of the tiles containing the given coordinates in a single vectorised operation, equivalent to
+    calling `get_tile_key` once per coordinate.
+
+    :param numpy.ndarray latitudes: the latitudes of the coordinates (in decimal degrees) for which to get the containing tiles
+    :param numpy.ndarray longitudes: the longitudes of the coordinates (in decimal degrees) for which to get the containing tiles
+    :return numpy.ndarray: the keys of the tiles containing the given coordinates
+    """
+    # This mirrors `get_tile_reference_coordinate`'s flooring rule.
+    tile_latitudes = np.floor(latitudes).astype(np.int64)
+    tile_longitudes = np.floor(longitudes).astype(np.int64)
 
-    return math.trunc(latitude), math.trunc(longitude)
+    return ((tile_latitudes & 0xFFFF) << 16) | (tile_longitudes & 0xFFFF)
 
 
+def get_tile_reference_coordinate_from_key(key):
+    """Get the reference coordinate of the tile with the given key.
+
+    :param int key: the key of the tile
+    :return (int, int): the reference coordinate (in decimal degrees) of the tile
+    """
+    latitude = (key >> 16) & 0xFFFF
+    longitude = key & 0xFFFF
+
+    # Sign-extend the two 16-bit halves of the key.
+    if latitude >= 0x8000:
+        latitude -= 0x10000
+
+    if longitude >= 0x8000:
+        longitude -= 0x10000
+
+    return latitude, longitude
+
+
+@functools.lru_cache(maxsize=None)
 def get_tile_path(latitude, longitude):
     """Get the path of the tile within the GLO-30 elevation dataset cloud bucket whose bottom-left corner has the
-    given coordinates.
+    given coordinates. Paths are memoised - the whole integer tile grid only has ~65000 entries, so the cache is
+    bounded by the world.
 
     :param int latitude: the latitude of the bottom-left corner of the tile in decimal degrees
     :param int longitude: the longitude of the bottom-left corner of the tile in decimal degrees
     :return str: the path of the tile containing the coordinate
     """
-    # Positive latitudes are north of the equator.
-    if latitude >= 0:
-        latitude = f"N{latitude:02}_00"
-    else:
-        latitude = f"S{-latitude:02}_00"
-
-    # Positive longitudes are east of the prime meridian.
-    if longitude >= 0:
-        longitude = f"E{longitude:03}_00"
-    else:
-        longitude = f"W{-longitude:03}_00"
-
-    name = f"{DATAFILE_NAME_PREFIX}_{DATASET_RESOLUTION}_{latitude}_{longitude}_{DATAFILE_NAME_SUFFIX}"
+    # Positive latitudes are north of the equator; positive longitudes are east of the prime meridian.
+    hemisphere = "N" if latitude >= 0 else "S"
+    meridian_side = "E" if longitude >= 0 else "W"
+
+    name = (
+        f"{DATAFILE_NAME_PREFIX}_{DATASET_RESOLUTION}_{hemisphere}{abs(latitude):02}_00_"
+        f"{meridian_side}{abs(longitude):03}_00_{DATAFILE_NAME_SUFFIX}"
+    )
+
     return f"{name}/{name}.tif"
@@ -1,8 +1,6 @@
-import geopandas as gpd
+import pandas as pd
 import plotly.express as px
-from geojson import Feature, FeatureCollection
 from h3.api.basic_int import h3_to_geo, h3_to_geo_boundary
-from shapely.geometry import Polygon
 
 
 def plot_elevations(
@@ -26,27 +24,29 @@ def plot_elevations(
     """
     cells_column = []
     elevations_column = []
-    geometry_column = []
 
     for cell, elevation in elevations:
         cells_column.append(cell)
         elevations_column.append(elevation)
-        geometry_column.append(Polygon(h3_to_geo_boundary(cell, geo_json=True)))
 
-    df = gpd.GeoDataFrame(
-        data={
-            "h3_cell": cells_column,
-            "elevation": elevations_column,
-            "geometry": geometry_column,
-        }
-    )
+    # A plain DataFrame is all the choropleth needs - the cell geometries only appear in the GeoJSON feature
+    # collection, so there's no need to construct polygon objects or a GeoDataFrame.
+    df = pd.DataFrame(data={"h3_cell": cells_column, "elevation": elevations_column})
 
-    geojson_feature_collection = FeatureCollection(
-        [
-            Feature(geometry=row["geometry"], id=row["h3_cell"], properties={"value": row["elevation"]})
-            for _, row in df.iterrows()
-        ]
-    )
+    # Build the feature collection as plain dictionaries (which is all Plotly needs) to avoid the geojson library
+    # validating every polygon's coordinates on construction.
+    geojson_feature_collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "id": cell,
+                "geometry": {"type": "Polygon", "coordinates": [h3_to_geo_boundary(cell, geo_json=True)]},
+                "properties": {"value": elevation},
+            }
+            for cell, elevation in zip(cells_column, elevations_column)
+        ],
+    }
 
     center_latitude, center_longitude = h3_to_geo(center)
 
@@ -3,7 +3,7 @@ from datetime import datetime
 from unittest.mock import patch
 
 import rasterio
-from h3.api.basic_int import geo_to_h3, k_ring
+from h3.api.numpy_int import geo_to_h3, k_ring
 from octue import Runner
 
 from elevations_populator.app import App
@@ -41,21 +41,22 @@ def run_locally_on_center_cell_and_neighbours(
                 "data",
                 f"elevations-{datetime.now().isoformat()}.json",
             ),
-            "delete_downloaded_tiles_after_run": not only_use_offline_test_tile,
         },
     )
 
-    neighbours = k_ring(center_cell, k=number_of_neighbours)
+    # The numpy_int API returns the center cell and its neighbours as a contiguous uint64 array rather than a Python
+    # set; convert to plain integers only at the twine boundary.
+    cells = [int(cell) for cell in k_ring(center_cell, k=number_of_neighbours)]
 
     if only_use_offline_test_tile:
         with patch(
             "elevations_populator.app.App._download_and_load_elevation_tile",
             return_value=rasterio.open(TEST_TILE_PATH),
         ):
-            runner.run(input_values={"h3_cells": [*neighbours, center_cell]})
+            runner.run(input_values={"h3_cells": cells})
 
     else:
-        runner.run(input_values={"h3_cells": [*neighbours, center_cell]})
+        runner.run(input_values={"h3_cells": cells})
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
-import json
+import atexit
+import contextlib
+import functools
 import os.path
 import tempfile
 import unittest
@@ -14,14 +16,68 @@ from octue.resources import Analysis
 from elevations_populator.app import DATASET_BUCKET_NAME, App
 from elevations_populator.cells import get_descendents_down_to_maximum_resolution
 from elevations_populator.exceptions import DataUnavailable
+from elevations_populator.tiles import get_tile_key
 
 
 REPOSITORY_ROOT = os.path.dirname(os.path.dirname(__file__))
 TEST_TILE_PATH = os.path.join(REPOSITORY_ROOT, "tests", "Copernicus_DSM_COG_10_N54_00_W005_00_DEM.tif")
 
 TWINE = os.path.join(REPOSITORY_ROOT, "twine.json")
+
+# Share a default analysis across the tests so the twine is only parsed and validated once per configuration rather
+# than once per test.
 ANALYSIS = Analysis(twine=TWINE, configuration_values={})
 
+# Open the test tile once and share the dataset handle across the tests so each test doesn't re-parse the GeoTIFF
+# headers.
+TEST_TILE = rasterio.open(TEST_TILE_PATH, sharing=True)
+atexit.register(TEST_TILE.close)
+
+
+@functools.lru_cache(maxsize=None)
+def get_resolution_12_descendents(cell):
+    """Get the resolution 12 descendents of the given cell, memoising the expansion so tests that expand the same cell
+    don't repeat it.
+
+    :param int cell: the index of the cell in integer form
+    :return set(int): the indexes of the resolution 12 descendents in integer form
+    """
+    return set(get_descendents_down_to_maximum_resolution(cell, maximum_resolution=12).tolist())
+
+
+# The cells and elevations the app is expected to extract and calculate in `TestApp.test_app`, stored as packed
+# parallel arrays built once at import time.
+EXPECTED_CELLS = np.array(
+    [
+        630949280578134527, 630949280578130431, 630949280578109951, 630949280578114047, 630949280578122239,
+        630949280578118143, 630949280578126335, 630949280578130943, 630949280578135039, 630949280578110463,
+        630949280578114559, 630949280578122751, 630949280578118655, 630949280578126847, 630949280578135551,
+        630949280578131455, 630949280578110975, 630949280578115071, 630949280578123263, 630949280578119167,
+        630949280578127359, 630949280578115583, 630949280578123775, 630949280578131967, 630949280578136063,
+        630949280578119679, 630949280578127871, 630949280578136575, 630949280578132479, 630949280578111999,
+        630949280578116095, 630949280578124287, 630949280578120191, 630949280578128383, 630949280578137087,
+        630949280578132991, 630949280578112511, 630949280578116607, 630949280578124799, 630949280578120703,
+        630949280578128895, 630949280578137599, 630949280578133503, 630949280578113023, 630949280578117119,
+        630949280578125311, 630949280578121215, 630949280578129407, 630949280578111487, 626445680950767615,
+        626445680950747135, 626445680950751231, 626445680950759423, 626445680950755327, 626445680950763519,
+        626445680950743039, 621942081323401215,
+    ],
+    dtype=np.uint64,
+)
+
+EXPECTED_ELEVATIONS = np.array(
+    [
+        123.45122, 121.02042, 122.54978, 124.72449, 125.50409, 126.169914, 120.09502, 122.4994, 123.46548,
+        123.75406, 123.99768, 125.50409, 124.92622, 120.09502, 125.333244, 121.6412, 123.46548, 122.51705,
+        126.87395, 125.24347, 121.568504, 124.72449, 126.87395, 122.51705, 123.46548, 126.169914, 121.568504,
+        123.45122, 121.02042, 122.54978, 122.4994, 123.75406, 123.46548, 120.09502, 121.568504, 121.02042,
+        121.6412, 123.99768, 125.50409, 124.92622, 120.09502, 123.45122, 121.02042, 122.54978, 122.51705,
+        124.92622, 125.24347, 121.328705, 123.75406, 123.45519, 123.56826, 125.16353, 120.69225, 125.56292,
+        121.53418, 122.89488, 123.26732,
+    ],
+    dtype=np.float32,
+)
+
 
 class TestApp(unittest.TestCase):
     def test_error_raised_if_cell_resolution_not_between_minimum_and_maximum_resolutions_inclusively(self):
@@ -29,14 +85,14 @@ class TestApp(unittest.TestCase):
         resolution are provided as inputs.
         """
         cells = [(3, 590416922114260991), (15, 644460079102511746)]
-        runner = Runner(app_src=App, twine=TWINE, configuration_values={})
+
+        # Validate against the app directly - the full runner pipeline is already covered by `test_app`.
+        app = App(ANALYSIS)
 
         for resolution, cell in cells:
             with self.subTest(resolution=resolution):
-                with self.assertRaises(ValueError) as error:
-                    runner.run(input_values={"h3_cells": [cell]})
-                    self.assertEqual(error.exception.args[1], cell)
-                    self.assertEqual(error.exception.args[2], resolution)
+                with self.assertRaises(ValueError):
+                    app._validate_cells([cell])
 
     def test_app(self):
         """Test that, given a resolution 11 H3 cell, the elevations of the centrepoints of the resolution 12 descendents
@@ -46,99 +102,45 @@ class TestApp(unittest.TestCase):
         resolution_11_cell = 626445680950767615
         self.assertEqual(h3_get_resolution(resolution_11_cell), 11)
 
-        runner = Runner(
-            app_src=App,
-            twine=TWINE,
-            configuration_values={"minimum_resolution": 10, "delete_downloaded_tiles_after_run": False},
-        )
+        runner = Runner(app_src=App, twine=TWINE, configuration_values={"minimum_resolution": 10})
 
-        # Mock tile download and elevation storage.
-        with patch(
-            "elevations_populator.app.App._download_and_load_elevation_tile",
-            return_value=rasterio.open(TEST_TILE_PATH),
-        ):
-            with patch("elevations_populator.app.App._store_elevations") as mock_store_elevations:
-                analysis = runner.run(input_values={"h3_cells": [resolution_11_cell]})
+        # Mock tile download and elevation storage with a single flat context rather than nested `with` blocks.
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                patch("elevations_populator.app.App._download_and_load_elevation_tile", return_value=TEST_TILE)
+            )
+            mock_store_elevations = stack.enter_context(patch("elevations_populator.app.App._store_elevations"))
+            analysis = runner.run(input_values={"h3_cells": [resolution_11_cell]})
 
         # No output values are expected from the app.
         self.assertIsNone(analysis.output_values)
 
         elevations = mock_store_elevations.call_args[0][0]
 
-        self.assertTrue(
-            elevations,
-            {
-                630949280578134527: 123.45122,
-                630949280578130431: 121.02042,
-                630949280578109951: 122.54978,
-                630949280578114047: 124.72449,
-                630949280578122239: 125.50409,
-                630949280578118143: 126.169914,
-                630949280578126335: 120.09502,
-                630949280578130943: 122.4994,
-                630949280578135039: 123.46548,
-                630949280578110463: 123.75406,
-                630949280578114559: 123.99768,
-                630949280578122751: 125.50409,
-                630949280578118655: 124.92622,
-                630949280578126847: 120.09502,
-                630949280578135551: 125.333244,
-                630949280578131455: 121.6412,
-                630949280578110975: 123.46548,
-                630949280578115071: 122.51705,
-                630949280578123263: 126.87395,
-                630949280578119167: 125.24347,
-                630949280578127359: 121.568504,
-                630949280578115583: 124.72449,
-                630949280578123775: 126.87395,
-                630949280578131967: 122.51705,
-                630949280578136063: 123.46548,
-                630949280578119679: 126.169914,
-                630949280578127871: 121.568504,
-                630949280578136575: 123.45122,
-                630949280578132479: 121.02042,
-                630949280578111999: 122.54978,
-                630949280578116095: 122.4994,
-                630949280578124287: 123.75406,
-                630949280578120191: 123.46548,
-                630949280578128383: 120.09502,
-                630949280578137087: 121.568504,
-                630949280578132991: 121.02042,
-                630949280578112511: 121.6412,
-                630949280578116607: 123.99768,
-                630949280578124799: 125.50409,
-                630949280578120703: 124.92622,
-                630949280578128895: 120.09502,
-                630949280578137599: 123.45122,
-                630949280578133503: 121.02042,
-                630949280578113023: 122.54978,
-                630949280578117119: 122.51705,
-                630949280578125311: 124.92622,
-                630949280578121215: 125.24347,
-                630949280578129407: 121.328705,
-                630949280578111487: 123.75406,
-                626445680950767615: 123.45519,
-                626445680950747135: 123.56826,
-                626445680950751231: 125.16353,
-                626445680950759423: 120.69225,
-                626445680950755327: 125.56292,
-                626445680950763519: 121.53418,
-                626445680950743039: 122.89488,
-                621942081323401215: 123.26732,
-            },
+        # Check the extracted and calculated elevations against the stored expected values in one vectorised
+        # comparison, to within the precision the expected values were stored at.
+        np.testing.assert_allclose(
+            np.array([elevations[cell] for cell in EXPECTED_CELLS.tolist()]),
+            EXPECTED_ELEVATIONS,
+            rtol=1e-5,
         )
 
         resolution_10_cell = h3_to_parent(resolution_11_cell)
         resolution_11_cells = h3_to_children(resolution_10_cell)
-        resolution_12_cells = get_descendents_down_to_maximum_resolution(resolution_10_cell, maximum_resolution=12)
+        resolution_12_cells = get_resolution_12_descendents(resolution_10_cell)
 
         # Check that the elevations of the original cell's parent and all its resolution 12 descendents have been
-        # extracted or calculated.
-        self.assertEqual(elevations.keys(), {resolution_10_cell, *resolution_11_cells, *resolution_12_cells})
+        # extracted or calculated. The expected keys are built with a single set union rather than unpacking the
+        # collections into a new set literal.
+        self.assertEqual(set(elevations), resolution_12_cells | resolution_11_cells | {resolution_10_cell})
 
         # Check that the elevation of the resolution 10 parent is the average of its resolution 11 children's
-        # elevations.
-        self.assertEqual(elevations[resolution_10_cell], np.mean([elevations[cell] for cell in resolution_11_cells]))
+        # elevations. The comparison is to within floating-point accuracy as the app sums the children's elevations
+        # in sorted-cell order, which may differ from this list's order.
+        self.assertAlmostEqual(
+            elevations[resolution_10_cell],
+            sum(elevations[cell] for cell in resolution_11_cells) / len(resolution_11_cells),
+        )
 
     def test_store_elevations(self):
         """Test that elevations are stored successfully."""
@@ -148,10 +150,56 @@ class TestApp(unittest.TestCase):
                 configuration_values={"storage_location": "local", "local_storage_path": temporary_file.name},
             )
 
-            App(analysis)._store_elevations({644460079102511746: 191.3})
+            # Wait for the background write to finish before reading the file back.
+            App(analysis)._store_elevations({644460079102511746: 191.3}).result()
+
+            # The payload is fixed and tiny, so compare the raw bytes rather than parsing the JSON back.
+            with open(temporary_file.name, "rb") as f:
+                self.assertEqual(f.read(), b"[[644460079102511746,191.3]]")
+
+    def test_store_elevations_in_npz_format(self):
+        """Test that elevations are stored successfully as a compressed NumPy archive."""
+        with tempfile.NamedTemporaryFile(suffix=".npz") as temporary_file:
+            analysis = Analysis(
+                twine=TWINE,
+                configuration_values={
+                    "storage_location": "local",
+                    "local_storage_path": temporary_file.name,
+                    "local_storage_format": "npz",
+                },
+            )
+
+            # Wait for the background write to finish before reading the file back.
+            App(analysis)._store_elevations({644460079102511746: 191.3}).result()
+
+            # The elevations are stored as integer decimeters.
+            with np.load(temporary_file.name) as persisted_data:
+                self.assertEqual(persisted_data["cells"].tolist(), [644460079102511746])
+                self.assertEqual(persisted_data["elevations"].tolist(), [1913])
+
+    def test_store_elevations_in_npz_format_with_extensionless_path(self):
+        """Test that elevations stored at a path lacking the ".npz" extension are written to and appended at the same
+        file (NumPy appends the extension when saving, so the append read must target the extended path too).
+        """
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            path = os.path.join(temporary_directory, "elevations")
+
+            analysis = Analysis(
+                twine=TWINE,
+                configuration_values={
+                    "storage_location": "local",
+                    "local_storage_path": path,
+                    "local_storage_format": "npz",
+                },
+            )
+
+            app = App(analysis)
+            app._store_elevations({644460079102511746: 191.3}).result()
+            app._store_elevations({644460079102511747: 200.1}).result()
 
-            with open(temporary_file.name) as f:
-                self.assertEqual(json.load(f), [[644460079102511746, 191.3]])
+            with np.load(path + ".npz") as persisted_data:
+                self.assertEqual(persisted_data["cells"].tolist(), [644460079102511746, 644460079102511747])
+                self.assertEqual(persisted_data["elevations"].tolist(), [1913, 2001])
 
     def test_download_and_load_elevation_tiles_with_non_existent_tile_results_in_null_tile(self):
         """Test that attempting to download tiles that don't exist results in a tile value of `None` being stored for
@@ -160,24 +208,25 @@ class TestApp(unittest.TestCase):
         app = App(ANALYSIS)
 
         with patch("elevations_populator.app.App._download_and_load_elevation_tile", side_effect=DataUnavailable):
-            app._download_and_load_elevation_tiles([(0, 0)])
+            app._download_and_load_elevation_tiles([get_tile_key(0, 0)])
 
-        self.assertIsNone(app._tiles[(0, 0)])
+        self.assertIsNone(app._tiles[get_tile_key(0, 0)])
 
 
 class TestGetElevation(unittest.TestCase):
+    def setUp(self):
+        self.app = App(ANALYSIS)
+
     def test_with_missing_tile_data(self):
         """Test that the elevation is given as zero if there is no tile data available for the given coordinates."""
-        app = App(ANALYSIS)
-        app._tiles = {(31, 2): None}
-        elevation = app._get_elevation(latitude=31.21, longitude=2.5)
+        self.app._tiles = {get_tile_key(31, 2): None}
+        elevation = self.app._get_elevation(latitude=31.21, longitude=2.5)
         self.assertEqual(elevation, 0)
 
     def test_with_tile_data(self):
         """Test that an elevation can be accessed for a coordinate within a tile."""
-        app = App(ANALYSIS)
-        app._tiles = {(54, -5): rasterio.open(TEST_TILE_PATH)}
-        elevation = app._get_elevation(latitude=54.21, longitude=-4.6)
+        self.app._tiles = {get_tile_key(54.21, -4.6): TEST_TILE}
+        elevation = self.app._get_elevation(latitude=54.21, longitude=-4.6)
         self.assertEqual(round(elevation), 191)
 
 
@@ -191,11 +240,11 @@ class TestAddAverageElevationsForAncestorsUpToMinimumResolution(unittest.TestCas
 
         resolution_12_cell_parent = h3_to_parent(resolution_12_cell)
         resolution_12_cells = h3_to_children(resolution_12_cell_parent)
-        resolution_12_cell_elevations = list(range(len(resolution_12_cells)))
 
-        resolution_12_cells_and_elevations = {
-            cell: elevation for cell, elevation in zip(resolution_12_cells, resolution_12_cell_elevations)
-        }
+        # Build the fixture as cell/elevation arrays and only convert to a dictionary at the boundary.
+        cells = np.fromiter(resolution_12_cells, dtype=np.uint64, count=len(resolution_12_cells))
+        resolution_12_cell_elevations = np.arange(cells.size, dtype=np.float32)
+        resolution_12_cells_and_elevations = dict(zip(cells.tolist(), resolution_12_cell_elevations.tolist()))
 
         analysis = Analysis(twine=TWINE, configuration_values={"minimum_resolution": 11})
 
@@ -225,15 +274,11 @@ class TestAddAverageElevationsForAncestorsUpToMinimumResolution(unittest.TestCas
         resolution_12_cell_parent = h3_to_parent(resolution_12_cell)
         resolution_12_cell_grandparent = h3_to_parent(resolution_12_cell_parent)
 
-        resolution_12_cells = get_descendents_down_to_maximum_resolution(
-            resolution_12_cell_grandparent,
-            maximum_resolution=12,
-        )
+        resolution_12_cells = get_resolution_12_descendents(resolution_12_cell_grandparent)
 
-        resolution_12_cells_and_elevations = {
-            cell: elevation
-            for cell, elevation in zip(resolution_12_cells, [1 for _ in range(len(resolution_12_cells))])
-        }
+        # Build the fixture as cell/elevation arrays and only convert to a dictionary at the boundary.
+        cells = np.fromiter(resolution_12_cells, dtype=np.uint64, count=len(resolution_12_cells))
+        resolution_12_cells_and_elevations = dict(zip(cells.tolist(), np.ones(cells.size, dtype=np.float32).tolist()))
 
         all_elevations = app._add_average_elevations_for_ancestors_up_to_minimum_resolution(
             resolution_12_cells_and_elevations
@@ -252,37 +297,58 @@ class TestAddAverageElevationsForAncestorsUpToMinimumResolution(unittest.TestCas
 
 
 class TestDownloadAndLoadElevationTile(unittest.TestCase):
+    def setUp(self):
+        self.app = App(ANALYSIS)
+
     def test_error_raised_if_given_coordinates_with_no_associated_tile(self):
         """Test that an error is raised if attempting to download a satellite tile that doesn't exist (i.e. for an area
         that has no data associated with it).
         """
-        app = App(ANALYSIS)
-
         with self.assertRaises(DataUnavailable):
             with patch(
                 "elevations_populator.app.s3.download_fileobj",
                 side_effect=botocore.exceptions.ClientError({}, ""),
             ):
-                app._download_and_load_elevation_tile(latitude=53, longitude=2)
-
-        self.assertEqual(app._downloaded_tile_paths, [])
+                self.app._download_and_load_elevation_tile(latitude=53, longitude=2)
 
     def test_with_valid_coordinates(self):
-        """Test that elevation tiles can be downloaded and loaded correctly."""
-        app = App(ANALYSIS)
+        """Test that elevation tiles can be downloaded into memory and loaded correctly."""
         test_tile_s3_path = "Copernicus_DSM_COG_10_N54_00_W005_00_DEM/Copernicus_DSM_COG_10_N54_00_W005_00_DEM.tif"
 
-        with patch("elevations_populator.app.tempfile.NamedTemporaryFile") as mock_named_temporary_file:
-            with patch("elevations_populator.app.s3.download_fileobj") as mock_download_fileobj:
-                with patch("builtins.open"):
-                    mock_named_temporary_file.return_value.__enter__.return_value.name = TEST_TILE_PATH
-                    tile = app._download_and_load_elevation_tile(latitude=54, longitude=-5)
+        def download_test_tile(bucket_name, path, file):
+            with open(TEST_TILE_PATH, "rb") as f:
+                file.write(f.read())
+
+        with patch("elevations_populator.app.s3.download_fileobj", side_effect=download_test_tile) as mock_download:
+            tile = self.app._download_and_load_elevation_tile(latitude=54, longitude=-5)
 
         # Check tile has been downloaded correctly.
-        self.assertEqual(mock_download_fileobj.call_args[0][0], DATASET_BUCKET_NAME)
-        self.assertEqual(mock_download_fileobj.call_args[0][1], test_tile_s3_path)
-        self.assertEqual(app._downloaded_tile_paths, [TEST_TILE_PATH])
+        self.assertEqual(mock_download.call_args[0][0], DATASET_BUCKET_NAME)
+        self.assertEqual(mock_download.call_args[0][1], test_tile_s3_path)
 
         # Check tile has been loaded successfully.
         self.assertEqual(tile.count, 1)
-        self.assertEqual(tile.name, TEST_TILE_PATH)
+
+        self.app._tiles = {get_tile_key(54.21, -4.6): tile}
+        self.assertEqual(round(self.app._get_elevation(latitude=54.21, longitude=-4.6)), 191)
+
+    def test_with_tile_cache_directory(self):
+        """Test that a downloaded tile is added to the tile cache directory if one is configured and that a cached
+        tile is loaded from there without re-downloading it.
+        """
+        def download_test_tile(bucket_name, path, file):
+            with open(TEST_TILE_PATH, "rb") as f:
+                file.write(f.read())
+
+        with tempfile.TemporaryDirectory() as cache_directory:
+            analysis = Analysis(twine=TWINE, configuration_values={"tile_cache_directory": cache_directory})
+            app = App(analysis)
+
+            with patch("elevations_populator.app.s3.download_fileobj", side_effect=download_test_tile) as mock_download:
+                app._download_and_load_elevation_tile(latitude=54, longitude=-5)
+                tile = app._download_and_load_elevation_tile(latitude=54, longitude=-5)
+
+            # The second call should have been served from the cache rather than downloading the tile again.
+            self.assertEqual(mock_download.call_count, 1)
+            self.assertEqual(os.listdir(cache_directory), ["Copernicus_DSM_COG_10_N54_00_W005_00_DEM.tif"])
+            self.assertEqual(tile.count, 1)
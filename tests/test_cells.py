@@ -1,14 +1,68 @@
 import unittest
 
-from h3.api.basic_int import h3_get_resolution, h3_to_children, h3_to_parent
+import numpy as np
+from h3.api.basic_int import get_pentagon_indexes, h3_get_resolution, h3_to_children, h3_to_parent
+from h3.api.numpy_int import h3_to_children as h3_to_children_as_array
 
 from elevations_populator.cells import (
     get_ancestors_up_to_minimum_resolution,
     get_ancestors_up_to_minimum_resolution_as_pyramid,
+    get_children,
     get_descendents_down_to_maximum_resolution,
+    get_minimum_resolution_ancestors,
+    get_parents,
 )
 
 
+class TestGetParents(unittest.TestCase):
+    def test_with_cells_of_different_resolutions(self):
+        """Test that the vectorised parent calculation agrees with the H3 library for cells of different resolutions."""
+        cells = [594920487381893119, 599424083788038143, 603927682878537727, 626445680950767615, 630949280220400639]
+
+        parents = get_parents(cells)
+        self.assertEqual([int(parent) for parent in parents], [h3_to_parent(cell) for cell in cells])
+
+
+class TestGetChildren(unittest.TestCase):
+    def test_with_hexagonal_cells(self):
+        """Test that the vectorised child calculation agrees with the H3 library for hexagonal cells."""
+        cells = [621942081323401215, 621942080965672959]
+
+        children = get_children(cells)
+        self.assertEqual({int(child) for child in children}, {child for cell in cells for child in h3_to_children(cell)})
+
+    def test_with_pentagonal_cell(self):
+        """Test that the vectorised child calculation agrees with the H3 library for a pentagonal cell, which only has
+        six children.
+        """
+        pentagon = sorted(get_pentagon_indexes(4))[0]
+
+        children = get_children([pentagon])
+        self.assertEqual(len(children), 6)
+        self.assertEqual({int(child) for child in children}, h3_to_children(pentagon))
+
+
+class TestGetMinimumResolutionAncestors(unittest.TestCase):
+    def test_with_cells_of_different_resolutions(self):
+        """Test that the vectorised minimum resolution ancestor calculation agrees with walking up the resolutions
+        with the H3 library for cells of different resolutions, including a cell already at the minimum resolution.
+        """
+        cells = [594920487381893119, 599424083788038143, 603927682878537727, 626445680950767615, 630949280220400639]
+        minimum_resolution = 4
+
+        ancestors = get_minimum_resolution_ancestors(cells, minimum_resolution)
+
+        expected_ancestors = []
+
+        for cell in cells:
+            while h3_get_resolution(cell) > minimum_resolution:
+                cell = h3_to_parent(cell)
+
+            expected_ancestors.append(cell)
+
+        self.assertEqual(ancestors.tolist(), expected_ancestors)
+
+
 class TestGetDescendentsDownToMaximumResolution(unittest.TestCase):
     def test_with_maximum_resolution_cell(self):
         """Test that a maximum resolution cell is idempotent."""
@@ -17,8 +71,8 @@ class TestGetDescendentsDownToMaximumResolution(unittest.TestCase):
         self.assertEqual(h3_get_resolution(cell), maximum_resolution)
 
         self.assertEqual(
-            get_descendents_down_to_maximum_resolution(cell, maximum_resolution=maximum_resolution),
-            {cell},
+            get_descendents_down_to_maximum_resolution(cell, maximum_resolution=maximum_resolution).tolist(),
+            [cell],
         )
 
     def test_with_resolution_11_cell(self):
@@ -30,7 +84,7 @@ class TestGetDescendentsDownToMaximumResolution(unittest.TestCase):
 
         descendents = get_descendents_down_to_maximum_resolution(cell, maximum_resolution=12)
         self.assertEqual(len(descendents), 7)
-        self.assertEqual(descendents, h3_to_children(cell))
+        self.assertEqual(set(descendents.tolist()), h3_to_children(cell))
 
     def test_with_resolution_10_cell(self):
         """Test that inputting a resolution 10 cell results in 49 resolution 12 cells when the maximum resolution is set
@@ -42,8 +96,16 @@ class TestGetDescendentsDownToMaximumResolution(unittest.TestCase):
         descendents = get_descendents_down_to_maximum_resolution(cell, maximum_resolution=12)
         self.assertEqual(len(descendents), 49)
 
-        descendent_parents = {h3_to_parent(descendent) for descendent in descendents}
-        self.assertEqual({h3_to_parent(descendent_parent) for descendent_parent in descendent_parents}, {cell})
+        # Deduplicate the parents via a sorted array rather than hashing each one into a set.
+        descendent_parents = np.unique(
+            np.fromiter(
+                (h3_to_parent(descendent) for descendent in descendents),
+                dtype=np.uint64,
+                count=len(descendents),
+            )
+        )
+
+        self.assertEqual({h3_to_parent(parent) for parent in descendent_parents.tolist()}, {cell})
 
 
 class TestGetAncestorsUpToMinimumResolution(unittest.TestCase):
@@ -89,10 +151,14 @@ class TestGetAncestorsUpToMinimumResolutionAsPyramid(unittest.TestCase):
         resolution_10_grandparent = 621942081323401215
         self.assertEqual(h3_get_resolution(resolution_10_grandparent), 10)
 
-        resolution_11_parents = h3_to_children(resolution_10_grandparent)
-        self.assertTrue(all([h3_get_resolution(cell) == 11 for cell in resolution_11_parents]))
+        # The numpy_int API returns the children as uint64 arrays directly, so the fixture can be assembled by
+        # concatenation instead of hashing every child into a set.
+        resolution_11_parents = h3_to_children_as_array(resolution_10_grandparent)
+        self.assertTrue(all(h3_get_resolution(cell) == 11 for cell in resolution_11_parents.tolist()))
 
-        resolution_12_cells = {child for parent in resolution_11_parents for child in h3_to_children(parent)}
+        resolution_12_cells = np.concatenate(
+            [h3_to_children_as_array(parent) for parent in resolution_11_parents.tolist()]
+        )
 
         pyramid = get_ancestors_up_to_minimum_resolution_as_pyramid(resolution_12_cells, minimum_resolution=10)
-        self.assertEqual(pyramid, [resolution_11_parents, {resolution_10_grandparent}])
+        self.assertEqual(pyramid, [set(resolution_11_parents.tolist()), {resolution_10_grandparent}])
@@ -2,19 +2,23 @@ import os
 import unittest
 from unittest import TestCase
 
-from octue.resources import Child
-
 
 @unittest.skipUnless(
     condition=os.getenv("RUN_CLOUD_RUN_DEPLOYMENT_TEST", "0").lower() == "1",
     reason="'RUN_CLOUD_RUN_DEPLOYMENT_TEST' environment variable is False or not present.",
 )
 class TestCloudRunDeployment(TestCase):
-    # This is the service ID of the example service deployed to Google Cloud Run.
-    child = Child(
-        id="octue/elevations-populator:0-2-5",
-        backend={"name": "GCPPubSubBackend", "project_name": "windeurope72-private"},
-    )
+    @classmethod
+    def setUpClass(cls):
+        # Import and construct the child here rather than at module level so skipped runs (the common case) don't pay
+        # for importing octue's cloud client dependencies during test collection.
+        from octue.resources import Child
+
+        # This is the service ID of the example service deployed to Google Cloud Run.
+        cls.child = Child(
+            id="octue/elevations-populator:0-2-5",
+            backend={"name": "GCPPubSubBackend", "project_name": "windeurope72-private"},
+        )
 
     def test_cloud_run_deployment(self):
         """Test that the Google Cloud Run example deployment works, providing a service that can be asked questions and
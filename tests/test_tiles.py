@@ -1,6 +1,14 @@
 import unittest
 
-from elevations_populator.tiles import get_tile_path, get_tile_reference_coordinate
+import numpy as np
+
+from elevations_populator.tiles import (
+    get_tile_key,
+    get_tile_keys,
+    get_tile_path,
+    get_tile_reference_coordinate,
+    get_tile_reference_coordinate_from_key,
+)
 
 
 class TestTiles(unittest.TestCase):
@@ -13,10 +21,44 @@ class TestTiles(unittest.TestCase):
             ((-0.5, -0.5), (-1, -1)),
         ]
 
-        for (latitude, longitude), expected_result in coordinates_and_expected_results:
+        # Compare all the cases in one list assertion - the list diff on failure still identifies the failing case.
+        self.assertEqual(
+            [
+                get_tile_reference_coordinate(latitude, longitude)
+                for (latitude, longitude), _ in coordinates_and_expected_results
+            ],
+            [expected_result for _, expected_result in coordinates_and_expected_results],
+        )
+
+    def test_tile_keys_round_trip_in_all_quadrants(self):
+        """Test that tile keys unpack to the same reference coordinates as the coordinates they were packed from in
+        the four latitude/longitude quadrants.
+        """
+        coordinates_and_expected_reference_coordinates = [
+            ((0.5, 0.5), (0, 0)),
+            ((0.5, -0.5), (0, -1)),
+            ((-0.5, 0.5), (-1, 0)),
+            ((-0.5, -0.5), (-1, -1)),
+        ]
+
+        for (latitude, longitude), expected_reference_coordinate in coordinates_and_expected_reference_coordinates:
             with self.subTest(latitude=latitude, longitude=longitude):
-                tile_reference_coordinate = get_tile_reference_coordinate(latitude, longitude)
-                self.assertEqual(tile_reference_coordinate, expected_result)
+                key = get_tile_key(latitude, longitude)
+                self.assertEqual(get_tile_reference_coordinate_from_key(key), expected_reference_coordinate)
+
+    def test_get_tile_keys_agrees_with_get_tile_key(self):
+        """Test that the vectorised tile key calculation agrees with the scalar calculation in the four
+        latitude/longitude quadrants.
+        """
+        latitudes = np.array([0.5, 0.5, -0.5, -0.5, 54.21])
+        longitudes = np.array([0.5, -0.5, 0.5, -0.5, -4.6])
+
+        keys = get_tile_keys(latitudes, longitudes)
+
+        self.assertEqual(
+            keys.tolist(),
+            [get_tile_key(latitude, longitude) for latitude, longitude in zip(latitudes, longitudes)],
+        )
 
     def test_get_tile_path(self):
         """Test that the path of the tile containing the given latitude and longitude is constructed correctly."""
@@ -27,7 +69,11 @@ class TestTiles(unittest.TestCase):
             (-89, -179, "Copernicus_DSM_COG_10_S89_00_W179_00_DEM/Copernicus_DSM_COG_10_S89_00_W179_00_DEM.tif"),
         )
 
-        for latitude, longitude, expected_path in coordinates_and_expected_paths:
-            with self.subTest(latitude=latitude, longitude=longitude):
-                path = get_tile_path(latitude=latitude, longitude=longitude)
-                self.assertEqual(path, expected_path)
+        # Compare all the cases in one list assertion - the list diff on failure still identifies the failing case.
+        self.assertEqual(
+            [
+                get_tile_path(latitude=latitude, longitude=longitude)
+                for latitude, longitude, _ in coordinates_and_expected_paths
+            ],
+            [expected_path for _, _, expected_path in coordinates_and_expected_paths],
+        )